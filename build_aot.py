@@ -0,0 +1,34 @@
+"""
+This script compiles the time evolution kernel ahead of time with numba, so the simulation
+can run the compiled kernel where numba isn't installed.
+
+Output Files:
+    heston_aot.*.so (heston_aot.*.pyd on Windows) - The compiled kernels, which run.py uses
+        when numba can't be imported.
+"""
+
+from numba import njit
+from numba.pycc import CC
+from heston.kernels import evolve_loops
+
+cc = CC('heston_aot')
+_evolve_serial = njit(fastmath=True)(evolve_loops)
+
+
+# ***************************************************************************************
+@cc.export('evolve_f32', 'f4[:](f4[:, ::1], f4[:, ::1], f4[::1], f4[::1], f8, f8, f8, f8, f8, f8, f8, b1)')
+def evolve_f32(dw_v, dw_i, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, log_euler):
+    """ Single precision version of evolve_loops() only returning the final prices. """
+    return _evolve_serial(dw_v, dw_i, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, 0, log_euler)[0]
+
+
+# ***************************************************************************************
+@cc.export('evolve_f64', 'f8[:](f8[:, ::1], f8[:, ::1], f8[::1], f8[::1], f8, f8, f8, f8, f8, f8, f8, b1)')
+def evolve_f64(dw_v, dw_i, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, log_euler):
+    """ Double precision version of evolve_loops() only returning the final prices. """
+    return _evolve_serial(dw_v, dw_i, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, 0, log_euler)[0]
+
+
+# ***************************************************************************************
+if __name__ == "__main__":
+    cc.compile()
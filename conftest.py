@@ -0,0 +1,3 @@
+"""
+This file puts the repository root on sys.path, so plain pytest can import heston.
+"""
@@ -0,0 +1,5 @@
+"""
+A Monte Carlo option pricing simulation using the Heston model for stochastic volatility.
+"""
+
+from heston.pricing import BIN_WIDTH, HestonParams, Stats, simulate_paths
@@ -0,0 +1,167 @@
+/*
+ * The time evolution of the Monte Carlo paths in C, as an alternative to the numba kernel.
+ *
+ * The paths are split between threads with OpenMP, and each thread evolves 4 (double) or
+ * 8 (single precision) paths at once with AVX2 and FMA instructions.  The remaining paths,
+ * or all of them when compiled without AVX2, are evolved one at a time.  The arguments
+ * and scheme match heston.kernels.evolve_numpy(), except only the final stock prices are
+ * returned.  Build the shared library loaded by heston.kernels with:
+ *
+ *     gcc -O3 -mavx2 -mfma -fopenmp -shared -fPIC heston/heston_kernel.c -o heston/libheston_kernel.so -lm
+ */
+
+#include <math.h>
+#ifdef __AVX2__
+#include <immintrin.h>
+#endif
+#ifdef _OPENMP
+#include <omp.h>
+#endif
+
+
+/* ************************************************************************************ */
+void set_num_threads(int threads)
+{
+#ifdef _OPENMP
+    omp_set_num_threads(threads);
+#endif
+}
+
+
+/* ************************************************************************************ */
+static double evolve_path_f64(const double *dw_v, const double *dw_i, double rho, double rho_c, double x_o,
+                              double v_o, double r_dt, double a, double b, double sigma, double half_dt, long n,
+                              int log_euler)
+{
+    double x = x_o, v = v_o;
+    for (long t = 0; t < n; t++) {
+        double v_pos = v > 0.0 ? v : 0.0;
+        double sqrt_v = sqrt(v_pos);
+        double dw_s = rho * dw_v[t] + rho_c * dw_i[t];
+        if (log_euler)
+            x += r_dt - half_dt * v_pos + sqrt_v * dw_s;
+        else
+            x += r_dt * x + sqrt_v * x * dw_s;
+        v += b - a * v_pos + sigma * sqrt_v * dw_v[t];
+    }
+    return log_euler ? exp(x) : x;
+}
+
+
+/* ************************************************************************************ */
+static float evolve_path_f32(const float *dw_v, const float *dw_i, float rho, float rho_c, float x_o, float v_o,
+                             float r_dt, float a, float b, float sigma, float half_dt, long n, int log_euler)
+{
+    float x = x_o, v = v_o;
+    for (long t = 0; t < n; t++) {
+        float v_pos = v > 0.0f ? v : 0.0f;
+        float sqrt_v = sqrtf(v_pos);
+        float dw_s = rho * dw_v[t] + rho_c * dw_i[t];
+        if (log_euler)
+            x += r_dt - half_dt * v_pos + sqrt_v * dw_s;
+        else
+            x += r_dt * x + sqrt_v * x * dw_s;
+        v += b - a * v_pos + sigma * sqrt_v * dw_v[t];
+    }
+    return log_euler ? expf(x) : x;
+}
+
+
+/* ************************************************************************************ */
+void evolve_f64(double *s_t, const double *dw_v, const double *dw_i, const double *rho, const double *rho_c,
+                double s_o, double v_o, double r, double kappa, double theta, double sigma, double dt, long m,
+                long n, int log_euler)
+{
+    const double a = kappa * dt, b = kappa * theta * dt, r_dt = r * dt, half_dt = 0.5 * dt;
+    const double x_o = log_euler ? log(s_o) : s_o;
+    long m_simd = 0;
+
+#ifdef __AVX2__
+    m_simd = m - m % 4;
+    #pragma omp parallel for schedule(static)
+    for (long i = 0; i < m_simd; i += 4) {
+        const double *v0 = dw_v + i * n, *v1 = v0 + n, *v2 = v1 + n, *v3 = v2 + n;
+        const double *i0 = dw_i + i * n, *i1 = i0 + n, *i2 = i1 + n, *i3 = i2 + n;
+        const __m256d zero = _mm256_setzero_pd(), a4 = _mm256_set1_pd(a), b4 = _mm256_set1_pd(b);
+        const __m256d r_dt4 = _mm256_set1_pd(r_dt), half_dt4 = _mm256_set1_pd(half_dt);
+        const __m256d sigma4 = _mm256_set1_pd(sigma), one_r_dt4 = _mm256_set1_pd(1.0 + r_dt);
+        const __m256d rho4 = _mm256_loadu_pd(rho + i), rho_c4 = _mm256_loadu_pd(rho_c + i);
+        __m256d x4 = _mm256_set1_pd(x_o), v4 = _mm256_set1_pd(v_o);
+        for (long t = 0; t < n; t++) {
+            __m256d dw_v4 = _mm256_set_pd(v3[t], v2[t], v1[t], v0[t]);
+            __m256d dw_i4 = _mm256_set_pd(i3[t], i2[t], i1[t], i0[t]);
+            __m256d dw_s4 = _mm256_fmadd_pd(rho4, dw_v4, _mm256_mul_pd(rho_c4, dw_i4));
+            __m256d v_pos4 = _mm256_max_pd(v4, zero);
+            __m256d sqrt_v4 = _mm256_sqrt_pd(v_pos4);
+            if (log_euler)
+                x4 = _mm256_add_pd(x4, _mm256_fmadd_pd(sqrt_v4, dw_s4, _mm256_fnmadd_pd(half_dt4, v_pos4, r_dt4)));
+            else
+                x4 = _mm256_mul_pd(x4, _mm256_fmadd_pd(sqrt_v4, dw_s4, one_r_dt4));
+            v4 = _mm256_add_pd(v4, _mm256_fmadd_pd(_mm256_mul_pd(sigma4, sqrt_v4), dw_v4,
+                                                   _mm256_fnmadd_pd(a4, v_pos4, b4)));
+        }
+        double x[4];
+        _mm256_storeu_pd(x, x4);
+        for (int k = 0; k < 4; k++)
+            s_t[i + k] = log_euler ? exp(x[k]) : x[k];
+    }
+#endif
+
+    #pragma omp parallel for schedule(static)
+    for (long i = m_simd; i < m; i++)
+        s_t[i] = evolve_path_f64(dw_v + i * n, dw_i + i * n, rho[i], rho_c[i], x_o, v_o, r_dt, a, b, sigma,
+                                 half_dt, n, log_euler);
+}
+
+
+/* ************************************************************************************ */
+void evolve_f32(float *s_t, const float *dw_v, const float *dw_i, const float *rho, const float *rho_c,
+                double s_o, double v_o, double r, double kappa, double theta, double sigma, double dt, long m,
+                long n, int log_euler)
+{
+    const float a = (float)(kappa * dt), b = (float)(kappa * theta * dt), r_dt = (float)(r * dt);
+    const float half_dt = (float)(0.5 * dt), sigma_f = (float)sigma, v_o_f = (float)v_o;
+    const float x_o = (float)(log_euler ? log(s_o) : s_o);
+    long m_simd = 0;
+
+#ifdef __AVX2__
+    m_simd = m - m % 8;
+    #pragma omp parallel for schedule(static)
+    for (long i = 0; i < m_simd; i += 8) {
+        const float *v_rows[8], *i_rows[8];
+        for (int k = 0; k < 8; k++) {
+            v_rows[k] = dw_v + (i + k) * n;
+            i_rows[k] = dw_i + (i + k) * n;
+        }
+        const __m256 zero = _mm256_setzero_ps(), a8 = _mm256_set1_ps(a), b8 = _mm256_set1_ps(b);
+        const __m256 r_dt8 = _mm256_set1_ps(r_dt), half_dt8 = _mm256_set1_ps(half_dt);
+        const __m256 sigma8 = _mm256_set1_ps(sigma_f), one_r_dt8 = _mm256_set1_ps(1.0f + r_dt);
+        const __m256 rho8 = _mm256_loadu_ps(rho + i), rho_c8 = _mm256_loadu_ps(rho_c + i);
+        __m256 x8 = _mm256_set1_ps(x_o), v8 = _mm256_set1_ps(v_o_f);
+        for (long t = 0; t < n; t++) {
+            __m256 dw_v8 = _mm256_set_ps(v_rows[7][t], v_rows[6][t], v_rows[5][t], v_rows[4][t],
+                                         v_rows[3][t], v_rows[2][t], v_rows[1][t], v_rows[0][t]);
+            __m256 dw_i8 = _mm256_set_ps(i_rows[7][t], i_rows[6][t], i_rows[5][t], i_rows[4][t],
+                                         i_rows[3][t], i_rows[2][t], i_rows[1][t], i_rows[0][t]);
+            __m256 dw_s8 = _mm256_fmadd_ps(rho8, dw_v8, _mm256_mul_ps(rho_c8, dw_i8));
+            __m256 v_pos8 = _mm256_max_ps(v8, zero);
+            __m256 sqrt_v8 = _mm256_sqrt_ps(v_pos8);
+            if (log_euler)
+                x8 = _mm256_add_ps(x8, _mm256_fmadd_ps(sqrt_v8, dw_s8, _mm256_fnmadd_ps(half_dt8, v_pos8, r_dt8)));
+            else
+                x8 = _mm256_mul_ps(x8, _mm256_fmadd_ps(sqrt_v8, dw_s8, one_r_dt8));
+            v8 = _mm256_add_ps(v8, _mm256_fmadd_ps(_mm256_mul_ps(sigma8, sqrt_v8), dw_v8,
+                                                   _mm256_fnmadd_ps(a8, v_pos8, b8)));
+        }
+        float x[8];
+        _mm256_storeu_ps(x, x8);
+        for (int k = 0; k < 8; k++)
+            s_t[i + k] = log_euler ? expf(x[k]) : x[k];
+    }
+#endif
+
+    #pragma omp parallel for schedule(static)
+    for (long i = m_simd; i < m; i++)
+        s_t[i] = evolve_path_f32(dw_v + i * n, dw_i + i * n, rho[i], rho_c[i], x_o, v_o_f, r_dt, a, b, sigma_f,
+                                 half_dt, n, log_euler);
+}
@@ -0,0 +1,342 @@
+"""
+The kernels performing the time evolution of the Monte Carlo paths.
+
+evolve() is the CPU kernel, which is the first available of the C kernel in
+heston_kernel.c, the numba kernel, the ahead-of-time compiled kernel from build_aot.py and
+the NumPy fallback.  The C kernel is only used once it has been built, and the
+ahead-of-time kernel only when numba itself can't be imported.  evolve_gpu() performs the
+time evolution on a CUDA GPU.
+"""
+
+import ctypes
+import math
+import numpy as np
+import os
+
+try:
+    from numba import config, njit, prange, set_num_threads as numba_set_num_threads
+except ImportError:
+    config = njit = prange = numba_set_num_threads = None
+
+# A missing or broken CUDA target only disables the GPU kernel
+try:
+    from numba import cuda, float32
+    from numba.cuda.random import xoroshiro128p_normal_float32
+except ImportError:
+    cuda = float32 = None
+
+try:
+    import heston_aot
+except ImportError:
+    heston_aot = None
+
+try:
+    heston_c = np.ctypeslib.load_library('libheston_kernel', os.path.dirname(os.path.abspath(__file__)))
+except OSError:
+    heston_c = None
+else:
+    for _name, _type in (('evolve_f32', np.float32), ('evolve_f64', np.float64)):
+        _array = np.ctypeslib.ndpointer(dtype=_type, ndim=1, flags='C_CONTIGUOUS')
+        _matrix = np.ctypeslib.ndpointer(dtype=_type, ndim=2, flags='C_CONTIGUOUS')
+        getattr(heston_c, _name).argtypes = [_array, _matrix, _matrix, _array, _array] + [ctypes.c_double] * 7 + \
+                                            [ctypes.c_long, ctypes.c_long, ctypes.c_int]
+        getattr(heston_c, _name).restype = None
+    heston_c.set_num_threads.argtypes = [ctypes.c_int]
+    heston_c.set_num_threads.restype = None
+
+
+BLOCK = 16  # Number of paths evolved together by the numba kernel
+
+
+# ***************************************************************************************
+def set_num_threads(threads):
+    """ Sets the number of threads used by the numba and C kernels.
+
+    Args:
+        threads (int):  Number of threads, which numba limits to NUMBA_NUM_THREADS.
+    """
+
+    if numba_set_num_threads is not None:
+        numba_set_num_threads(min(threads, config.NUMBA_NUM_THREADS))
+    if heston_c is not None:
+        heston_c.set_num_threads(threads)
+
+
+# ***************************************************************************************
+def evolve_numpy(dw_v, dw_i, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, n_save, log_euler):
+    """ Performs the time evolution of all paths with vectorized NumPy operations.
+
+    This is the fallback used when numba is not installed.  The volatility uses the full
+    truncation scheme of Lord et al., where the volatility may become negative but only
+    its positive part, max(v, 0), is used in the drift and diffusion terms.  The paths are
+    evolved in the precision of the Brownian increments.  The Brownian increments of the
+    stock price, rho * dw_v + sqrt(1 - rho^2) * dw_i, are calculated as they are needed.
+
+    Args:
+        dw_v (np.array):  [m, n] Brownian increments of the volatility.
+        dw_i (np.array):  [m, n] Independent Brownian increments, with the same type as
+            dw_v.
+        rho (np.array):  [m] Correlation coefficient of each path.
+        rho_c (np.array):  [m] The complementary coefficient, sqrt(1 - rho^2), of each
+            path.
+        s_o (float):  Initial stock price.
+        v_o (float):  Initial volatility.
+        r (float):  Risk free rate.
+        kappa (float):  Rate of mean reversion of the volatility.
+        theta (float):  Long term mean of the volatility.
+        sigma (float):  Volatility of the volatility.
+        dt (float):  Time step.
+        n_save (int):  Number of paths to return in full for plotting.
+        log_euler (bool):  True to evolve the log of the stock price, False to evolve the
+            stock price directly.
+
+    Returns:
+        np.array:  [m] The final stock price of each path.
+        np.array:  [n_save, n+1] The full time evolution of the first n_save paths.
+    """
+
+    # Only the current stock prices of all paths are kept, plus the history of the saved
+    # paths
+    m, n = dw_v.shape
+    x = np.full(m, np.log(s_o) if log_euler else s_o, dtype=dw_v.dtype)
+    x_save = np.empty((n_save, n + 1), dtype=dw_v.dtype)
+    x_save[:, 0] = x[:n_save]
+    v = np.full(m, v_o, dtype=dw_v.dtype)
+    a, b, r_dt, half_dt = kappa * dt, kappa * theta * dt, r * dt, 0.5 * dt
+
+    # All of the operations are done in place in these buffers, to avoid allocating new
+    # arrays at each time step
+    v_pos, sqrt_v, diffusion, work = np.empty((4, m), dtype=dw_v.dtype)
+    for t in range(n):
+        np.maximum(v, 0.0, out=v_pos)
+        np.sqrt(v_pos, out=sqrt_v)
+
+        # sqrt(v) * dW_S
+        np.multiply(rho, dw_v[:, t], out=diffusion)
+        np.multiply(rho_c, dw_i[:, t], out=work)
+        diffusion += work
+        diffusion *= sqrt_v
+
+        if log_euler:
+            np.multiply(v_pos, -half_dt, out=work)
+            work += r_dt
+            work += diffusion
+        else:
+            diffusion += r_dt
+            np.multiply(x, diffusion, out=work)
+        x += work
+        x_save[:, t + 1] = x[:n_save]
+
+        # v += b - a * v_pos + sigma * sqrt(v) * dW_V
+        np.multiply(sqrt_v, dw_v[:, t], out=work)
+        work *= sigma
+        v += work
+        v_pos *= a
+        v -= v_pos
+        v += b
+
+    if log_euler:
+        return np.exp(x), np.exp(x_save)
+    return x, x_save
+
+
+# ***************************************************************************************
+def evolve_loops(dw_v, dw_i, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, n_save, log_euler):
+    """ Performs the time evolution in blocks of BLOCK paths.
+
+    Compiled with numba so the per step operations are fused into a single pass with the
+    path state held in a small array per block instead of a temporary array per operation.
+    Within each block the time steps are the outer loop and the paths the inner loop, so
+    the paths of a block are independent and are evolved together with SIMD instructions,
+    instead of each step waiting on the square root of the step before.  The blocks are
+    split evenly between the threads by prange, since every path takes the same time.  See
+    evolve_numpy() for the arguments and return values.
+    """
+
+    m, n = dw_v.shape
+    s_t = np.empty(m, dw_v.dtype)
+    s_save = np.empty((n_save, n + 1), dw_v.dtype)
+    s_save[:, 0] = s_o
+
+    # Cast all of the constants so single precision paths are not promoted to double
+    ftype = dw_v.dtype.type
+    zero = ftype(0.0)
+    x_o = ftype(math.log(s_o) if log_euler else s_o)
+    v_init = ftype(v_o)
+    sigma_f = ftype(sigma)
+    a, b = ftype(kappa * dt), ftype(kappa * theta * dt)
+    r_dt, half_dt = ftype(r * dt), ftype(0.5 * dt)
+    for block in prange((m + BLOCK - 1) // BLOCK):
+        first = block * BLOCK
+        size = min(BLOCK, m - first)
+        n_block_save = min(max(n_save - first, 0), size)
+        x = np.full(BLOCK, x_o, dw_v.dtype)
+        v = np.full(BLOCK, v_init, dw_v.dtype)
+        for t in range(n):
+            for j in range(size):
+                i = first + j
+                v_pos = v[j] if v[j] > zero else zero
+                sqrt_v = math.sqrt(v_pos)
+                dw_s = rho[i] * dw_v[i, t] + rho_c[i] * dw_i[i, t]
+                if log_euler:
+                    x[j] += r_dt - half_dt * v_pos + sqrt_v * dw_s
+                else:
+                    x[j] += r_dt * x[j] + sqrt_v * x[j] * dw_s
+                v[j] += b - a * v_pos + sigma_f * sqrt_v * dw_v[i, t]
+            for j in range(n_block_save):
+                s_save[first + j, t + 1] = math.exp(x[j]) if log_euler else x[j]
+        for j in range(size):
+            s_t[first + j] = math.exp(x[j]) if log_euler else x[j]
+
+    return s_t, s_save
+
+
+# ***************************************************************************************
+def evolve_aot(dw_v, dw_i, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, n_save, log_euler):
+    """ Performs the time evolution with the kernels compiled ahead of time by build_aot.py.
+
+    The compiled kernels run on a single thread and only return the final stock prices, so
+    the saved paths are evolved again with evolve_numpy().  See evolve_numpy() for the
+    arguments and return values.
+    """
+
+    compiled = heston_aot.evolve_f32 if dw_v.dtype == np.float32 else heston_aot.evolve_f64
+    s_t = compiled(dw_v, dw_i, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, log_euler)
+    s_save = evolve_numpy(dw_v[:n_save], dw_i[:n_save], rho[:n_save], rho_c[:n_save], s_o, v_o, r, kappa, theta,
+                          sigma, dt, n_save, log_euler)[1]
+
+    return s_t, s_save
+
+
+# ***************************************************************************************
+def evolve_c(dw_v, dw_i, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, n_save, log_euler):
+    """ Performs the time evolution with the C kernel in heston_kernel.c.
+
+    The C kernel only returns the final stock prices, so the saved paths are evolved again
+    with evolve_numpy().  See evolve_numpy() for the arguments and return values.
+    """
+
+    m, n = dw_v.shape
+    s_t = np.empty(m, dtype=dw_v.dtype)
+    compiled = heston_c.evolve_f32 if dw_v.dtype == np.float32 else heston_c.evolve_f64
+    compiled(s_t, dw_v, dw_i, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, m, n, log_euler)
+    s_save = evolve_numpy(dw_v[:n_save], dw_i[:n_save], rho[:n_save], rho_c[:n_save], s_o, v_o, r, kappa, theta,
+                          sigma, dt, n_save, log_euler)[1]
+
+    return s_t, s_save
+
+
+evolve_jit = None if njit is None else njit(parallel=True, fastmath=True, boundscheck=False, cache=True)(evolve_loops)
+if heston_c is not None:
+    evolve = evolve_c
+elif evolve_jit is not None:
+    evolve = evolve_jit
+elif heston_aot is not None:
+    evolve = evolve_aot
+else:
+    evolve = evolve_numpy
+
+
+# ***************************************************************************************
+def log_step(x, v, dw_v, dw_s, r_dt, a, b, sigma, half_dt):
+    """ Performs one single precision log-Euler time step of a single path with full truncation.
+
+    Args:
+        x (float):  Log of the stock price.
+        v (float):  Volatility.
+        dw_v (float):  Brownian increment of the volatility.
+        dw_s (float):  Brownian increment of the stock price.
+        r_dt (float):  Risk free rate times the time step.
+        a (float):  Rate of mean reversion times the time step.
+        b (float):  Rate of mean reversion times the long term mean and time step.
+        sigma (float):  Volatility of the volatility.
+        half_dt (float):  Half the time step.
+
+    Returns:
+        float:  Log of the stock price after the time step.
+        float:  Volatility after the time step.
+    """
+
+    v_pos = v if v > 0.0 else float32(0.0)
+    sqrt_v = math.sqrt(v_pos)
+    return x + r_dt - half_dt * v_pos + sqrt_v * dw_s, v + b - a * v_pos + sigma * sqrt_v * dw_v
+
+
+# ***************************************************************************************
+def evolve_kernel(rng_states, rho, rho_c, x_o, v_o, r_dt, a, b, sigma, half_dt, sqrt_dt, n, antithetic, s_t, s_save):
+    """ CUDA kernel performing the log-Euler time evolution with one thread per path.
+
+    The random increments are drawn on the device from one xoroshiro128+ state per thread.
+    With antithetic paths, thread i also evolves the antithetic path i + m / 2.  The final
+    stock prices are written to s_t and the first paths are saved in full to s_save.  All
+    of the arguments are single precision, see evolve_gpu() for the constants.
+    """
+
+    i = cuda.grid(1)
+    m = rho.size
+    if i >= m:
+        return
+
+    rho_i = rho[i]
+    rho_c_i = rho_c[i]
+    x_1 = x_2 = x_o
+    v_1 = v_2 = v_o
+    save = i < s_save.shape[0]
+    if save:
+        s_save[i, 0] = math.exp(x_o)
+    for t in range(n):
+        dw_v = xoroshiro128p_normal_float32(rng_states, i) * sqrt_dt
+        dw_s = rho_i * dw_v + rho_c_i * xoroshiro128p_normal_float32(rng_states, i) * sqrt_dt
+        x_1, v_1 = log_step_gpu(x_1, v_1, dw_v, dw_s, r_dt, a, b, sigma, half_dt)
+        if antithetic:
+            x_2, v_2 = log_step_gpu(x_2, v_2, -dw_v, -dw_s, r_dt, a, b, sigma, half_dt)
+        if save:
+            s_save[i, t + 1] = math.exp(x_1)
+    s_t[i] = math.exp(x_1)
+    if antithetic:
+        s_t[i + m] = math.exp(x_2)
+
+
+if cuda is not None:
+    log_step_gpu = cuda.jit(device=True)(log_step)
+    evolve_kernel = cuda.jit(evolve_kernel)
+
+
+# ***************************************************************************************
+def evolve_gpu(rng_states, rho, rho_c, s_o, v_o, r, kappa, theta, sigma, dt, n, n_save, antithetic):
+    """ Performs the log-Euler time evolution of one chunk of paths on a CUDA GPU.
+
+    The paths are evolved in single precision, which is much faster than double precision
+    on most GPUs.
+
+    Args:
+        rng_states (DeviceNDArray):  The random number generator state of each thread.
+        rho (np.array):  [m] Correlation coefficient of each path, or of each antithetic
+            pair if antithetic is True.
+        rho_c (np.array):  [m] The complementary coefficient, sqrt(1 - rho^2), matching rho.
+        s_o (float):  Initial stock price.
+        v_o (float):  Initial volatility.
+        r (float):  Risk free rate.
+        kappa (float):  Rate of mean reversion of the volatility.
+        theta (float):  Long term mean of the volatility.
+        sigma (float):  Volatility of the volatility.
+        dt (float):  Time step.
+        n (int):  Number of time steps.
+        n_save (int):  Number of paths to return in full for plotting.
+        antithetic (bool):  True to also evolve the antithetic path of each path.
+
+    Returns:
+        np.array:  [m] or [2m] The final stock price of each path.
+        np.array:  [n_save, n+1] The full time evolution of the first n_save paths.
+    """
+
+    threads = 256
+    s_t = cuda.device_array(2 * rho.size if antithetic else rho.size, dtype=np.float32)
+    s_save = cuda.device_array((n_save, n + 1), dtype=np.float32)
+    constants = [np.float32(c) for c in (np.log(s_o), v_o, r * dt, kappa * dt, kappa * theta * dt, sigma,
+                                         0.5 * dt, np.sqrt(dt))]
+    rho, rho_c = cuda.to_device(rho.astype(np.float32)), cuda.to_device(rho_c.astype(np.float32))
+    evolve_kernel[(rho.size + threads - 1) // threads, threads](
+        rng_states, rho, rho_c, *constants, n, antithetic, s_t, s_save)
+
+    return s_t.copy_to_host(), s_save.copy_to_host()
@@ -0,0 +1,336 @@
+"""
+The Monte Carlo simulation of the Heston model used to price a European call option.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+import numpy as np
+
+from heston import kernels
+
+try:
+    from numba.cuda.random import create_xoroshiro128p_states
+except ImportError:
+    create_xoroshiro128p_states = None
+
+CHUNK = 8192  # Number of paths evolved at once
+BIN_WIDTH = 0.02  # Width of the histogram bins used for the modes and plots
+
+
+# ***************************************************************************************
+@dataclass
+class HestonParams:
+    """ The constants of the Heston model and the size of the Monte Carlo simulation.
+
+    The default values follow the paper by Broadie and Kaya.
+
+    Attributes:
+        r (float):  Risk free rate.
+        s_o (float):  Initial stock price.
+        k (float):  Strike price of the option.
+        t_max (float):  Time to maturity in years.
+        v_o (float):  Initial volatility.
+        sigma (float):  Volatility of the volatility.
+        theta (float):  Long term mean of the volatility.
+        kappa (float):  Rate of mean reversion of the volatility.
+        rho_choice (tuple):  The possible correlation coefficients.
+        rho_probability (tuple):  The probability of each correlation coefficient.
+        n (int):  Number of time steps.
+        m (int):  Number of simulations.
+        ns (int):  Number of paths saved in full for plotting, which are taken from the
+            first chunk, so at most min(m, CHUNK), or half of that with antithetic paths.
+    """
+
+    r: float = 0.0319
+    s_o: float = 2.0
+    k: float = 2.0
+    t_max: float = 1.0
+    v_o: float = 0.010201
+    sigma: float = 0.61
+    theta: float = 0.019
+    kappa: float = 6.21
+    rho_choice: tuple = (-0.5, -0.7, -0.9)
+    rho_probability: tuple = (0.25, 0.5, 0.25)
+    n: int = 400
+    m: int = 400 * 400
+    ns: int = 40
+
+
+# ***************************************************************************************
+@dataclass
+class Stats:
+    """ The results of the Monte Carlo simulation.
+
+    Attributes:
+        price_mean (float):  Expected final stock price.
+        price_error (float):  Standard error of the expected final stock price, nan with the
+            Sobol' sampler.
+        price_std (float):  Standard deviation of the final stock prices.
+        price_mode (float):  Mode of the final stock prices.
+        payoff_mean (float):  Expected option payoff.
+        payoff_error (float):  Standard error of the expected option payoff, nan with the
+            Sobol' sampler.
+        payoff_std (float):  Standard deviation of the option payoffs.
+        payoff_mode (float):  Mode of the option payoffs.
+        option_price (float):  Present value of the expected payoff, i.e. the option price.
+        paths (np.array):  [ns, n+1] The full time evolution of the first ns paths.
+        price_counts (np.array):  Histogram of the final stock prices in bins of BIN_WIDTH
+            starting at zero.
+        payoff_counts (np.array):  Histogram of the option payoffs in bins of BIN_WIDTH
+            starting at zero.
+    """
+
+    price_mean: float
+    price_error: float
+    price_std: float
+    price_mode: float
+    payoff_mean: float
+    payoff_error: float
+    payoff_std: float
+    payoff_mode: float
+    option_price: float
+    paths: np.ndarray
+    price_counts: np.ndarray
+    payoff_counts: np.ndarray
+
+
+# ***************************************************************************************
+class _RunningStats:
+    """ The running mean and variance of values that arrive in chunks.
+
+    Each chunk is merged into the totals with the parallel form of Welford's algorithm by
+    Chan et al., which avoids the cancellation of the sum of squares formula.
+
+    Attributes:
+        count (int):  Number of values so far.
+        mean (float):  Mean of the values so far.
+        m2 (float):  Sum of the squared differences from the mean of the values so far.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, x):
+        """ Merges a chunk of values into the running statistics.
+
+        Args:
+            x (np.array):  The new values.
+        """
+
+        count = self.count + x.size
+        mean = x.mean()
+        deviation = x - mean
+        delta = mean - self.mean
+        self.m2 += np.dot(deviation, deviation) + delta ** 2 * self.count * x.size / count
+        self.mean += delta * x.size / count
+        self.count = count
+
+    @property
+    def std(self):
+        """ float:  Standard deviation of the values so far. """
+        return np.sqrt(self.m2 / self.count)
+
+    @property
+    def error(self):
+        """ float:  Standard error of the mean of the values so far. """
+        return np.sqrt(self.m2 / self.count / self.count)
+
+
+# ***************************************************************************************
+def _brownian_bridge(z, dt):
+    """ Converts standard normal samples into Brownian increments with a Brownian bridge.
+
+    The first sample of each path sets its final value and the following samples fill in
+    the midpoints of the remaining intervals, coarsest first.  This way the leading
+    dimensions of a quasi-random sequence determine the overall shape of the paths.
+
+    Args:
+        z (np.array):  [m, n] Standard normal samples.
+        dt (float):  Time step.
+
+    Returns:
+        np.array:  [m, n] Brownian increments with a variance of dt.
+    """
+
+    m, n = z.shape
+    w = np.zeros((m, n + 1))
+    w[:, n] = np.sqrt(n * dt) * z[:, 0]
+    j = 1
+    intervals = deque([(0, n)])
+    while intervals:
+        left, right = intervals.popleft()
+        if right - left < 2:
+            continue
+        mid = (left + right) // 2
+        mean = ((right - mid) * w[:, left] + (mid - left) * w[:, right]) / (right - left)
+        w[:, mid] = mean + np.sqrt((mid - left) * (right - mid) / (right - left) * dt) * z[:, j]
+        j += 1
+        intervals.append((left, mid))
+        intervals.append((mid, right))
+
+    return np.diff(w, axis=1)
+
+
+# ***************************************************************************************
+def _add_counts(counts, x):
+    """ Adds the histogram of x to the running histogram counts.
+
+    The bins are BIN_WIDTH wide starting at zero, so bin i covers
+    [i * BIN_WIDTH, (i + 1) * BIN_WIDTH).  Negative values are counted in the first bin.
+
+    Args:
+        counts (np.array):  The running counts, which may be extended.
+        x (np.array):  The new values.
+
+    Returns:
+        np.array:  The updated counts.
+    """
+
+    index = (x * (1.0 / BIN_WIDTH)).astype(np.int64)
+    np.maximum(index, 0, out=index)
+    new = np.bincount(index)
+    if new.size > counts.size:
+        new[:counts.size] += counts
+        return new
+    counts[:new.size] += new
+    return counts
+
+
+# ***************************************************************************************
+def simulate_paths(p, seed=None, method='log', antithetic=True, sampler='pseudo', device='cpu', dtype=np.float32):
+    """ Performs the Monte Carlo simulation of the Heston model.
+
+    Args:
+        p (HestonParams):  The model constants and simulation size.
+        seed (int):  Seed for the random number generator, None for an unpredictable seed.
+        method (str):  'log' to evolve the log of the stock price with the Euler scheme,
+            which removes the multiplicative chain between the time steps, or 'direct' to
+            evolve the stock price itself, which is kept for validation.
+        antithetic (bool):  True to pair each path with its antithetic path, which uses the
+            negated random increments, to reduce the variance of the estimates.
+        sampler (str):  'pseudo' for pseudo-random increments or 'sobol' for scrambled
+            Sobol' quasi-random increments built with a Brownian bridge, which requires
+            scipy.  The number of points, m or m / 2 with antithetic paths, must be a power
+            of 2 to keep the balance properties of the sequence.  The Sobol' points aren't
+            independent, so the standard errors aren't estimated and are returned as nan.
+        device (str):  'cpu' to evolve the paths on the CPU or 'gpu' to evolve them on a
+            CUDA GPU with the random increments drawn on the device, which requires numba,
+            the 'log' method and the 'pseudo' sampler.
+        dtype (type):  Floating point type used to evolve the paths on the CPU.  Single
+            precision halves the memory traffic and doubles the SIMD width, and is accurate
+            well beyond the simulation error.  The increments are drawn in this type, so the
+            two precisions give different random streams for the same seed.  The GPU always
+            uses single precision.
+
+    Returns:
+        Stats:  The statistics of the final stock prices and option payoffs.
+    """
+
+    if method not in ('log', 'direct'):
+        raise ValueError("Unknown method '{}', expected 'log' or 'direct'.".format(method))
+    if sampler not in ('pseudo', 'sobol'):
+        raise ValueError("Unknown sampler '{}', expected 'pseudo' or 'sobol'.".format(sampler))
+    points = p.m // 2 if antithetic else p.m
+    if sampler == 'sobol' and points & (points - 1):
+        raise ValueError("The Sobol' sampler requires a power of 2 number of points, not {}.".format(points))
+    if device not in ('cpu', 'gpu'):
+        raise ValueError("Unknown device '{}', expected 'cpu' or 'gpu'.".format(device))
+    if device == 'gpu':
+        if method != 'log' or sampler != 'pseudo':
+            raise ValueError("The GPU only supports the 'log' method and the 'pseudo' sampler.")
+        if kernels.cuda is None or not kernels.cuda.is_available():
+            raise RuntimeError("numba and a CUDA GPU are required to simulate on the GPU.")
+    if antithetic and p.m % 2:
+        raise ValueError("An even number of simulations is required for antithetic paths.")
+    saved = min(CHUNK, p.m) // 2 if antithetic else min(CHUNK, p.m)
+    if p.ns > saved:
+        raise ValueError("At most {} paths can be saved for plotting, not {}.".format(saved, p.ns))
+    if not np.isclose(sum(p.rho_probability), 1.0):
+        raise ValueError("The probabilities of the correlation coefficients must sum to 1.")
+
+    # Create random parameters and perform time evolution in chunks of paths
+    #    Only the final prices of each chunk are accumulated into the statistics and
+    #    histograms, and the full paths are only saved for the plotted paths.  This keeps
+    #    the working set of each chunk in cache.  By default the log of the stock price
+    #    is evolved, so each step is a simple addition instead of a repeated
+    #    multiplication.  The antithetic paths are the second half of each chunk, so the
+    #    standard errors are calculated from the mean of each antithetic pair.
+    # -----------------------------------------------------------------------------------
+    n, m = p.n, p.m
+    dt = p.t_max / n
+    rho_choice = np.array(p.rho_choice, dtype=dtype)
+    rho_cumulative = np.cumsum(p.rho_probability)
+    rho_cumulative[-1] = 1.0
+    s = np.empty((p.ns, n + 1))
+    price_stats, payoff_stats = _RunningStats(), _RunningStats()
+    if antithetic:
+        price_pair_stats, payoff_pair_stats = _RunningStats(), _RunningStats()
+    else:
+        price_pair_stats, payoff_pair_stats = price_stats, payoff_stats
+    price_counts = payoff_counts = np.zeros(0, dtype=np.int64)
+    bit_generator = np.random.Philox(seed)
+    if sampler == 'sobol':
+        from scipy.stats import norm, qmc
+        sobol = qmc.Sobol(d=2 * n, scramble=True, seed=seed)
+    if device == 'gpu':
+        seed_gpu = int(np.random.SeedSequence(seed).generate_state(1)[0])
+        rng_states = create_xoroshiro128p_states(CHUNK, seed=seed_gpu)
+    for chunk, first in enumerate(range(0, m, CHUNK)):
+        cs = min(CHUNK, m - first)
+        h = cs // 2 if antithetic else cs
+        n_save = min(max(p.ns - first, 0), h)
+
+        # Each chunk has its own independent stream so the results are reproducible
+        rng = np.random.Generator(bit_generator.jumped(chunk))
+        rho = rho_choice[np.searchsorted(rho_cumulative, rng.random(h), side='right')]
+        rho_c = np.sqrt(1.0 - rho ** 2)
+        if device == 'gpu':
+            s_t, s[first:first + n_save] = kernels.evolve_gpu(rng_states, rho, rho_c, p.s_o, p.v_o, p.r, p.kappa,
+                                                              p.theta, p.sigma, dt, n, n_save, antithetic)
+        else:
+            if sampler == 'sobol':
+                # Interleave the dimensions so both Brownian motions get the leading ones
+                z = norm.ppf(np.clip(sobol.random(h), 1e-10, 1.0 - 1e-10))
+                dw = np.stack((_brownian_bridge(z[:, 0::2], dt), _brownian_bridge(z[:, 1::2], dt))).astype(dtype)
+            else:
+                dw = rng.standard_normal((2, h, n), dtype=dtype)
+                dw *= np.sqrt(dt)
+            if antithetic:
+                dw = np.concatenate((dw, -dw), axis=1)
+                rho, rho_c = np.tile(rho, 2), np.tile(rho_c, 2)
+            dw_v, dw_i = dw
+            s_t, s[first:first + n_save] = kernels.evolve(dw_v, dw_i, rho, rho_c, p.s_o, p.v_o, p.r, p.kappa,
+                                                          p.theta, p.sigma, dt, n_save, method == 'log')
+
+        # Accumulate the statistics in double precision
+        s_t = s_t.astype(np.float64)
+        payoff = np.clip(s_t - p.k, a_min=0, a_max=None)
+        price_stats.update(s_t)
+        payoff_stats.update(payoff)
+        if antithetic:
+            price_pair_stats.update(0.5 * (s_t[:h] + s_t[h:]))
+            payoff_pair_stats.update(0.5 * (payoff[:h] + payoff[h:]))
+        price_counts = _add_counts(price_counts, s_t)
+        payoff_counts = _add_counts(payoff_counts, payoff)
+
+    # Calculate expected call option payoff and therefore option price
+    # -----------------------------------------------------------------------------------
+    if sampler == 'sobol':
+        price_error = payoff_error = np.nan
+    else:
+        price_error, payoff_error = price_pair_stats.error, payoff_pair_stats.error
+    return Stats(
+        price_mean=price_stats.mean,
+        price_error=price_error,
+        price_std=price_stats.std,
+        price_mode=(price_counts.argmax() + 0.5) * BIN_WIDTH,
+        payoff_mean=payoff_stats.mean,
+        payoff_error=payoff_error,
+        payoff_std=payoff_stats.std,
+        payoff_mode=(payoff_counts.argmax() + 0.5) * BIN_WIDTH,
+        option_price=payoff_stats.mean * np.exp(-p.r * p.t_max),
+        paths=s,
+        price_counts=price_counts,
+        payoff_counts=payoff_counts)
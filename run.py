@@ -1,100 +1,114 @@
 """
 This script runs the Monte Carlo simulation and generates the desired plots.
 
-Required Input Files:
-    settings.csv - Contains the constants to use in the Monte Carlo simulation.
+Optional Input Files:
+    settings.csv - Rows of 'name,value' replacing the defaults of the scalar HestonParams
+        fields, such as n or sigma.  The rho_choice and rho_probability tuples can't be set.
 
 Output Files:
-    results.csv - Contains the results from the Monte Carlo simulation.
     simulation.png - Time evolution of the stock price.
+    payoffs.png - Histogram of the option payoffs.
 """
 
+import csv
+from dataclasses import fields
 import numpy as np
 import os
 from time import time
 
+from heston import BIN_WIDTH, HestonParams, simulate_paths
+from heston.kernels import set_num_threads
+
 
 # ***************************************************************************************
-def simulate():
-    """ Performs the Monte Carlo simulation.
+def load_settings(path):
+    """ Loads the constants to use in the Monte Carlo simulation.
 
-    Output Files:
-        simulation.png - Time evolution of the stock price.
+    Args:
+        path (str):  Path to a CSV file with a 'name' and 'value' column, where each name is
+            a scalar attribute of HestonParams.
 
     Returns:
-        np.array:  [m, n+1] The m simulation results with n time steps.
+        dict:  The value of each constant, as an int for the integer fields.
     """
 
-    print('Starting the simulation.')
-    start = time()
+    scalars = {field.name: field.type for field in fields(HestonParams) if field.type in (int, float)}
+    settings = {}
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        for row in reader:
+            name, value = row.get('name'), row.get('value')
+            if name not in scalars:
+                raise ValueError("Unsupported setting '{}' on line {} of {}, expected one of {}.".format(
+                    name, reader.line_num, path, ', '.join(scalars)))
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                raise ValueError("Invalid value '{}' for '{}' on line {} of {}.".format(
+                    value, name, reader.line_num, path)) from None
+            if scalars[name] is int:
+                if not value.is_integer():
+                    raise ValueError("'{}' must be an integer, not {}, on line {} of {}.".format(
+                        name, value, reader.line_num, path))
+                value = int(value)
+            settings[name] = value
+
+    return settings
 
-    # Set the constants
-    # -----------------------------------------------------------------------------------
-    r = 0.0319
-    s_o = k = 2.0
-    t_max = 1.0
-    v_o = 0.010201
-    sigma = 0.61
-    theta = 0.019
-    kappa = 6.21
-    rho_choice = np.array([-0.5, -0.7, -0.9])
-    rho_probability = np.array([0.25, 0.5, 0.25])
-    n = 400
-    m = n * n
-
-    # Create random parameters
-    # -----------------------------------------------------------------------------------
-    dt = t_max / n
-    dw_v = np.random.normal(size=(m, n)) * np.sqrt(dt)
-    dw_i = np.random.normal(size=(m, n)) * np.sqrt(dt)
-    rho = np.random.choice(rho_choice, size=(m, 1), p=rho_probability)
-    dw_s = rho * dw_v + np.sqrt(1.0 - rho ** 2) * dw_i
-
-    # Perform time evolution (only saving all s values for plotting)
-    #    Could also speed this up by using log-returns and coefficients for repeated
-    #    multiplication but this is easier to read.
-    # -----------------------------------------------------------------------------------
-    s = np.empty((m, n + 1))
-    s[:, 0] = s_o
-    v = np.ones(m) * v_o
-    for t in range(n):
-        dv = kappa * (theta - v) * dt + sigma * np.sqrt(v) * dw_v[:, t]
-        ds = r * s[:, t] * dt + np.sqrt(v) * s[:, t] * dw_s[:, t]
-        v = np.clip(v + dv, a_min=0.0, a_max=None)
-        s[:, t + 1] = s[:, t] + ds
-
-    # Calculate expected call option payoff and therefore option price
-    # -----------------------------------------------------------------------------------
-    expected_price = s[:, -1].mean()
-    price_std = s[:, -1].std()
-    price_error = price_std / np.sqrt(m)
-    bins = np.arange(s[:, -1].min(), s[:, -1].max() + 0.02, 0.02)
-    price_mode = bins[np.histogram(s[:, -1], bins=bins)[0].argmax()] + 0.01
-
-    payoff = np.clip(s[:, -1] - k, a_min=0, a_max=None)
-    expected_payoff = payoff.mean()
-    payoff_std = payoff.std()
-    payoff_error = payoff_std / np.sqrt(m)
-    bins = np.arange(payoff.min(), payoff.max() + 0.02, 0.02)
-    payoff_mode = bins[np.histogram(payoff, bins=bins)[0].argmax()] + 0.01
-
-    c = expected_payoff * np.exp(-r * t_max)
-
-    print("Expected fuel price: ${:.4f} +/- ${:.4f}.".format(expected_price, price_error))
-    print("Expected payoff:     ${:.4f} +/- ${:.4f}.".format(expected_payoff, payoff_error))
-    print(" => Option price:    ${:.4f}.".format(c))
-    print("Total price to cover 2 Million Gallons is ${:,.0f}.\n".format(c * 2000000))
 
-    print("Price Mean, Mode, STD:  ${:.4f}, ${:.4f}, ${:.4f}.".format(expected_price, price_mode, price_std))
-    print("Payoff Mean, Mode, STD: ${:.4f}, ${:.4f}, ${:.4f}.\n".format(expected_payoff, payoff_mode, payoff_std))
+# ***************************************************************************************
+def _physical_cores():
+    """ Determines the number of physical CPU cores, which requires psutil.
 
-    print("Simulation time: {:.1f} seconds.".format(time() - start))
-    print("Number of time steps:  {:.0f}.".format(n))
-    print("Number of simulations: {:,.0f}.".format(m))
-    print("Total number samples:  {:,.0f}.".format(m * n))
+    Returns:
+        int:  The number of physical cores, None if it can't be determined.
+    """
+
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.cpu_count(logical=False)
+
+
+# ***************************************************************************************
+def _rebin(counts, low, high, width):
+    """ Sums the running histogram counts into the coarser bins of a plot.
+
+    Args:
+        counts (np.array):  The counts in bins of BIN_WIDTH starting at zero.
+        low (float):  Lower edge of the first bin, a multiple of BIN_WIDTH.
+        high (float):  Upper edge of the last bin.
+        width (float):  Width of the bins, a multiple of BIN_WIDTH.
+
+    Returns:
+        np.array:  The lower edge of each bin.
+        np.array:  The counts in each bin.
+    """
+
+    step = int(round(width / BIN_WIDTH))
+    first = int(round(low / BIN_WIDTH))
+    n_bins = int(round((high - low) / width))
+    fine = np.zeros(n_bins * step, dtype=counts.dtype)
+    part = counts[first:first + fine.size]
+    fine[:part.size] = part
+
+    return low + width * np.arange(n_bins), fine.reshape(n_bins, step).sum(axis=1)
+
+
+# ***************************************************************************************
+def plot(p, out):
+    """ Plots the results of the Monte Carlo simulation.
+
+    Args:
+        p (HestonParams):  The model constants and simulation size.
+        out (Stats):  The results of the simulation.
+
+    Output Files:
+        simulation.png - Time evolution of the stock price.
+        payoffs.png - Histogram of the option payoffs.
+    """
 
-    # Make pretty plots
-    # -----------------------------------------------------------------------------------
     import matplotlib.pyplot as plt
     from matplotlib.ticker import NullFormatter
     import seaborn as sns
@@ -113,21 +127,20 @@ def simulate():
     ax_histogram = plt.axes(rect_histogram)
 
     # Make the line plots
-    t = np.linspace(0, t_max, num=n + 1)
-    ns = 40
-    for i in range(ns):
-        ax_lines.plot(t, s[i, :], lw=1.0)
+    t = np.linspace(0, p.t_max, num=p.n + 1)
+    for i in range(p.ns):
+        ax_lines.plot(t, out.paths[i, :], lw=1.0)
     ax_lines.set(xlabel='Years', ylabel='Price of Fuel (St)',
-                 title='Fuel Price Simulations ({} of {:,.0f} plotted)'.format(ns, m))
+                 title='Fuel Price Simulations ({} of {:,.0f} plotted)'.format(p.ns, p.m))
     ax_lines.set_xlim((0, 1))
     ax_lines.set_ylim((1.4, 2.6))
 
     # Add mean value to line plots
-    ax_lines.plot([0.0, 1.0], [expected_price, expected_price], lw='2', ls="--")
+    ax_lines.plot([0.0, 1.0], [out.price_mean, out.price_mean], lw='2', ls="--")
 
     # Make the histogram for the final stock prices S_T
-    bins = np.arange(1.4, 3, .04)
-    ax_histogram.hist(s[:, -1], bins=bins, orientation='horizontal')
+    edges, counts = _rebin(out.price_counts, 1.4, 3.0, 0.04)
+    ax_histogram.barh(edges, counts, height=0.04, align='edge')
     ax_histogram.set_ylim(ax_lines.get_ylim())
     ax_histogram.xaxis.set_major_formatter(NullFormatter())
     ax_histogram.yaxis.set_major_formatter(NullFormatter())
@@ -135,22 +148,72 @@ def simulate():
 
     # Make the histogram for the Payoffs
     plt.figure()
-    plt.hist(payoff, bins=np.arange(0.0, 0.62, 0.02), density=True)
+    edges, counts = _rebin(out.payoff_counts, 0.0, 0.6, 0.02)
+    plt.bar(edges, counts / (counts.sum() * 0.02), width=0.02, align='edge')
     plt.title("Simulated Option Payoffs")
     plt.xlabel("Option Payoff")
     plt.ylabel("Probability")
     plt.savefig("payoffs.png")
 
 
+# ***************************************************************************************
+def simulate(seed=None, settings=None, **options):
+    """ Performs the Monte Carlo simulation, prints the results and plots them.
+
+    Args:
+        seed (int):  Seed for the random number generator, None for an unpredictable seed.
+        settings (dict):  Constants replacing the defaults of HestonParams, as returned by
+            load_settings().
+        options:  The simulation options passed on to heston.simulate_paths().
+
+    Output Files:
+        simulation.png - Time evolution of the stock price.
+        payoffs.png - Histogram of the option payoffs.
+    """
+
+    print('Starting the simulation.')
+    start = time()
+
+    p = HestonParams(**(settings or {}))
+    out = simulate_paths(p, seed=seed, **options)
+    c = out.option_price
+
+    print("Expected fuel price: ${:.4f} +/- ${:.4f}.".format(out.price_mean, out.price_error))
+    print("Expected payoff:     ${:.4f} +/- ${:.4f}.".format(out.payoff_mean, out.payoff_error))
+    print(" => Option price:    ${:.4f}.".format(c))
+    print("Total price to cover 2 Million Gallons is ${:,.0f}.\n".format(c * 2000000))
+
+    print("Price Mean, Mode, STD:  ${:.4f}, ${:.4f}, ${:.4f}.".format(out.price_mean, out.price_mode, out.price_std))
+    print("Payoff Mean, Mode, STD: ${:.4f}, ${:.4f}, ${:.4f}.\n".format(out.payoff_mean, out.payoff_mode,
+                                                                         out.payoff_std))
+
+    print("Simulation time: {:.1f} seconds.".format(time() - start))
+    print("Number of time steps:  {:.0f}.".format(p.n))
+    print("Number of simulations: {:,.0f}.".format(p.m))
+    print("Total number samples:  {:,.0f}.".format(p.m * p.n))
+
+    # Make pretty plots
+    # -----------------------------------------------------------------------------------
+    plot(p, out)
+
+
 # ***************************************************************************************
 if __name__ == "__main__":
 
     # Delete the old output files
     # -----------------------------------------------------------------------------------
-    for name in ['simulation.png', 'results.csv']:
+    for name in ['simulation.png', 'payoffs.png']:
         if os.path.isfile(name):
             os.remove(name)
 
+    # The time evolution is limited by the square roots and multiply-adds, so
+    # hyper-threading doesn't help.  Use one thread per physical core unless the number of
+    # threads was set explicitly.
+    # -----------------------------------------------------------------------------------
+    cores = _physical_cores()
+    if cores and 'NUMBA_NUM_THREADS' not in os.environ and 'OMP_NUM_THREADS' not in os.environ:
+        set_num_threads(cores)
+
     # Run the simulation
     # -----------------------------------------------------------------------------------
-    simulate()
+    simulate(settings=load_settings('settings.csv') if os.path.isfile('settings.csv') else None)
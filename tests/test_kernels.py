@@ -0,0 +1,75 @@
+"""
+Checks that every available CPU kernel gives the same paths as the NumPy fallback.
+"""
+
+import numpy as np
+import pytest
+
+from heston import kernels
+
+CONSTANTS = dict(s_o=2.0, v_o=0.010201, r=0.0319, kappa=6.21, theta=0.019, sigma=0.61)
+TOLERANCE = {np.float32: 1e-5, np.float64: 1e-12}
+KERNELS = [
+    pytest.param(kernels.evolve_jit, id='jit',
+                 marks=pytest.mark.skipif(kernels.evolve_jit is None, reason='numba is not installed')),
+    pytest.param(kernels.evolve_aot, id='aot',
+                 marks=pytest.mark.skipif(kernels.heston_aot is None, reason='heston_aot is not built')),
+    pytest.param(kernels.evolve_c, id='c',
+                 marks=pytest.mark.skipif(kernels.heston_c is None, reason='libheston_kernel is not built')),
+]
+
+
+# ***************************************************************************************
+def _increments(m, n, dtype):
+    """ Draws the random inputs of the kernels.
+
+    Args:
+        m (int):  Number of paths.
+        n (int):  Number of time steps.
+        dtype (type):  Floating point type of the inputs.
+
+    Returns:
+        tuple:  The dw_v, dw_i, rho and rho_c arguments of the kernels.
+        float:  Time step.
+    """
+
+    rng = np.random.default_rng(1)
+    dt = 1.0 / n
+    dw_v, dw_i = rng.standard_normal((2, m, n)) * np.sqrt(dt)
+    rho = rng.choice([-0.5, -0.7, -0.9], m)
+    return tuple(x.astype(dtype) for x in (dw_v, dw_i, rho, np.sqrt(1.0 - rho ** 2))), dt
+
+
+# ***************************************************************************************
+@pytest.mark.parametrize('evolve', KERNELS)
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+@pytest.mark.parametrize('log_euler', [True, False])
+def test_kernels_match_numpy(evolve, dtype, log_euler):
+    """ The number of paths isn't a multiple of 8, so the scalar remainders are checked too. """
+
+    args, dt = _increments(37, 100, dtype)
+    s_t, s_save = evolve(*args, dt=dt, n_save=3, log_euler=log_euler, **CONSTANTS)
+    s_t_numpy, s_save_numpy = kernels.evolve_numpy(*args, dt=dt, n_save=3, log_euler=log_euler, **CONSTANTS)
+
+    assert s_t.dtype == dtype
+    np.testing.assert_allclose(s_t, s_t_numpy, rtol=0.0, atol=TOLERANCE[dtype])
+    np.testing.assert_allclose(s_save, s_save_numpy, rtol=0.0, atol=TOLERANCE[dtype])
+
+
+# ***************************************************************************************
+@pytest.mark.parametrize('log_euler', [True, False])
+def test_single_precision_price(log_euler):
+    """ Single precision paths price the call within 1e-4 of double precision paths.
+
+    The same increments are used for both, since simulate_paths() draws different random
+    streams for each precision.
+    """
+
+    args, dt = _increments(20000, 100, np.float64)
+    prices = []
+    for dtype in (np.float64, np.float32):
+        s_t = kernels.evolve(*(x.astype(dtype) for x in args), dt=dt, n_save=0, log_euler=log_euler,
+                             **CONSTANTS)[0]
+        prices.append(np.maximum(s_t.astype(np.float64) - 2.0, 0.0).mean())
+
+    np.testing.assert_allclose(prices[1], prices[0], rtol=1e-4)
@@ -0,0 +1,121 @@
+"""
+Checks the Monte Carlo simulation and its helpers.
+"""
+
+import numpy as np
+import pytest
+
+from heston import kernels
+from heston.pricing import _brownian_bridge, _RunningStats, CHUNK, HestonParams, simulate_paths
+
+
+# ***************************************************************************************
+def _capture_evolve(monkeypatch):
+    """ Records the arguments and final stock prices of every call to the CPU kernel.
+
+    Args:
+        monkeypatch (MonkeyPatch):  The pytest fixture used to replace kernels.evolve.
+
+    Returns:
+        list:  The rho and final stock prices of each chunk, filled as the kernel is called.
+    """
+
+    calls = []
+    evolve = kernels.evolve
+
+    def recording_evolve(dw_v, dw_i, rho, *args):
+        s_t, s_save = evolve(dw_v, dw_i, rho, *args)
+        calls.append((rho.copy(), s_t.astype(np.float64)))
+        return s_t, s_save
+
+    monkeypatch.setattr(kernels, 'evolve', recording_evolve)
+    return calls
+
+
+# ***************************************************************************************
+@pytest.mark.parametrize('splits', [[], [1], [10, 11], [3, 500, 501, 999]])
+def test_running_stats(splits):
+    """ Merging the chunks gives the statistics of all of the values at once. """
+
+    x = 3.0 + 1e-3 * np.random.default_rng(1).standard_normal(1000)
+    stats = _RunningStats()
+    for chunk in np.split(x, splits):
+        if chunk.size:
+            stats.update(chunk)
+
+    assert stats.count == x.size
+    np.testing.assert_allclose(stats.mean, x.mean(), rtol=1e-14)
+    np.testing.assert_allclose(stats.std, np.std(x), rtol=1e-10)
+    np.testing.assert_allclose(stats.error, np.std(x) / np.sqrt(x.size), rtol=1e-10)
+
+
+# ***************************************************************************************
+@pytest.mark.parametrize('n', [8, 10])
+def test_brownian_bridge_variance(n):
+    """ Every increment has a variance of dt and the increments are uncorrelated. """
+
+    dt = 1.0 / n
+    dw = _brownian_bridge(np.random.default_rng(1).standard_normal((40000, n)), dt)
+
+    assert dw.shape == (40000, n)
+    np.testing.assert_allclose(dw.var(axis=0), dt, rtol=0.05)
+    np.testing.assert_allclose(np.corrcoef(dw, rowvar=False), np.eye(n), atol=0.03)
+
+
+# ***************************************************************************************
+def test_same_seed():
+    """ The same seed gives the same results and a different seed doesn't. """
+
+    p = HestonParams(n=4, m=1000, ns=5)
+    first, second, other = (simulate_paths(p, seed=seed) for seed in (1, 1, 2))
+
+    assert first.option_price == second.option_price
+    np.testing.assert_array_equal(first.paths, second.paths)
+    np.testing.assert_array_equal(first.payoff_counts, second.payoff_counts)
+    assert first.option_price != other.option_price
+
+
+# ***************************************************************************************
+def test_antithetic_error(monkeypatch):
+    """ The standard error is calculated from the means of the antithetic pairs. """
+
+    calls = _capture_evolve(monkeypatch)
+    p = HestonParams(n=4, m=1000, ns=5)
+    out = simulate_paths(p, seed=1)
+
+    (_, s_t), = calls
+    payoff = np.maximum(s_t - p.k, 0.0)
+    pairs = 0.5 * (payoff[:500] + payoff[500:])
+    np.testing.assert_allclose(out.payoff_mean, payoff.mean(), rtol=1e-12)
+    np.testing.assert_allclose(out.payoff_error, np.std(pairs) / np.sqrt(500), rtol=1e-10)
+    np.testing.assert_allclose(out.payoff_std, np.std(payoff), rtol=1e-10)
+
+
+# ***************************************************************************************
+@pytest.mark.parametrize('m, ns, antithetic', [(40, 21, True), (30, 31, False), (20000, CHUNK // 2 + 1, True)])
+def test_saved_paths_bound(m, ns, antithetic):
+    """ More paths than the first chunk saves can't be plotted, but all of them can. """
+
+    with pytest.raises(ValueError):
+        simulate_paths(HestonParams(n=4, m=m, ns=ns), antithetic=antithetic)
+    out = simulate_paths(HestonParams(n=4, m=m, ns=ns - 1), antithetic=antithetic)
+    assert out.paths.shape == (ns - 1, 5)
+    assert np.isfinite(out.paths).all()
+
+
+# ***************************************************************************************
+@pytest.mark.parametrize('probability', [(0.25, 0.5, 0.25), (0.0, 0.5, 0.5), (0.5, 0.0, 0.5), (0.5, 0.5, 0.0)])
+def test_rho_frequencies(monkeypatch, probability):
+    """ Each correlation coefficient is drawn with its probability, and never if that is 0. """
+
+    calls = _capture_evolve(monkeypatch)
+    p = HestonParams(n=4, m=40000, ns=5, rho_probability=probability)
+    simulate_paths(p, seed=1, antithetic=False)
+
+    rho = np.concatenate([rho for rho, _ in calls])
+    assert rho.size == p.m
+    frequency = [np.mean(rho == np.float32(choice)) for choice in p.rho_choice]
+    np.testing.assert_allclose(frequency, probability, atol=0.01)
+    for choice, chance in zip(p.rho_choice, probability):
+        if chance == 0.0:
+            assert not np.any(rho == np.float32(choice))